@@ -1,15 +1,358 @@
 #!/usr/bin/env python
 
 import argparse # conda install -c conda-forge googlemaps
-from datetime import datetime
+from datetime import datetime, timedelta
+import contextlib
 import csv
+import json
+import os
 import re
-import requests
+import sys
+import time
 from collections import OrderedDict
-import dateutil.parser
 
-import googlemaps
-import pycountry
+# googlemaps, requests, dateutil and pycountry are imported within the functions that use them
+# so that short runs do not pay their import cost up front
+
+# fallback reference point for --startup_profile where the process start time cannot be read from /proc
+PROCESS_START_TIME = time.perf_counter()
+
+# precomputed ISO 3166-1 alpha-3 country names from pycountry, so its database is not loaded on every run;
+# generated from the installed pycountry with write_country_name_snapshot() when the docker image is built
+COUNTRY_NAME_SNAPSHOT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pycountry_alpha_3_names.json")
+
+METADATA_FIELDS = [
+    "strain",
+    "virus",
+    "gisaid_epi_isl",
+    "genbank_accession",
+    "database",
+    "date",
+    "region",
+    "country",
+    "division",
+    "location",
+    "gb_raw_location",
+    "geocode_precision",
+    "region_exposure",
+    "country_exposure",
+    "division_exposure",
+    "length",
+    "host",
+    "age",
+    "sex",
+    "originating_lab",
+    "submitting_lab",
+    "date_submitted",
+    "biosample_accession",
+    "geocat",
+    "authors",
+    "url",
+    "title"
+]
+
+# Pairs of (output column name, source data field) requested from NCBI via "fl".  These are pulled
+# from watching requests from the UI.
+#
+# XXX TODO: Is the full set source data fields documented
+# somewhere?  Is there more info we could be pulling that'd be
+# useful?
+#   -trs, 13 May 2020
+NCBI_FIELDS = OrderedDict([
+    ('genbank_accession', 'id'),
+    ('database', 'SourceDB_s'),
+    ('strain', 'Isolate_s'),
+    ('region', 'Region_s'),
+    ('location', 'CountryFull_s'),
+    ('collected', 'CollectionDate_s'),
+    ('submitted', 'CreateDate_dt'),
+    ('length', 'SLen_i'),
+    ('host', 'Host_s'),
+    ('isolation_source', 'Isolation_csv'),
+    ('biosample_accession', 'BioSample_s'),
+    ('title', 'Definition_s'),
+    ('authors', 'Authors_csv'),
+    ('publications', 'PubMed_csv'),
+    ('sequence', 'Nucleotide_seq')
+])
+
+# columns read by curate_records; the others may be left out of the request (e.g. sequence for metadata-only runs)
+NCBI_FIELDS_REQUIRED = ['genbank_accession', 'database', 'strain', 'location', 'collected', 'submitted',
+                        'host', 'biosample_accession', 'title', 'authors']
+
+# records written between flushes of the ndjson stream, and the size of its write buffer;
+# a full buffer blocks on a slow reader rather than growing
+NDJSON_FLUSH_EVERY = 100
+NDJSON_BUFFER_BYTES = 1024 * 1024
+
+# rough in-memory size of one cached geocode result, used to size the LRU cache under --max_memory
+GEOCODE_ENTRY_BYTES = 2048
+
+# the strain ID Bloom filter under --max_memory is sized for this many strains at this false-positive rate
+# (about 1.2 MB per million strains at 1%); false positives only cost an extra lookup on disk
+EXPECTED_STRAIN_COUNT = 1000000
+BLOOM_FILTER_FALSE_POSITIVE_RATE = 0.01
+
+CONTINENT_FOR_COUNTRY = {  # see https://gist.github.com/nobuti/3816985
+    "AF": "Asia",  # "Islamic Republic of Afghanistan
+    "AX": "Europe",  # "Åland Islands
+    "AL": "Europe",  # "Republic of Albania
+    "DZ": "Africa",  # "People's Democratic Republic of Algeria
+    "AS": "Oceania",  # "American Samoa
+    "AD": "Europe",  # "Principality of Andorra
+    "AO": "Africa",  # "Republic of Angola
+    "AI": "North America",  # "Anguilla
+    "AQ": "Antarctica",  # "Antarctica (the territory South of 60 deg S)
+    "AG": "North America",  # "Antigua and Barbuda
+    "AR": "South America",  # "Argentine Republic
+    "AM": "Asia",  # "Republic of Armenia
+    "AW": "North America",  # "Aruba
+    "AU": "Oceania",  # "Commonwealth of Australia
+    "AT": "Europe",  # "Republic of Austri
+    "AZ": "Asia",  # "Republic of Azerbaijan
+    "BS": "North America",  # "Commonwealth of the Bahamas
+    "BH": "Asia",  # "Kingdom of Bahrain
+    "BD": "Asia",  # "People's Republic of Bangladesh
+    "BB": "North America",  # "Barbados
+    "BY": "Europe",  # "Republic of Belarus
+    "BE": "Europe",  # "Kingdom of Belgium
+    "BZ": "North America",  # "Belize
+    "BJ": "Africa",  # "Republic of Benin
+    "BM": "North America",  # "Bermuda
+    "BT": "Asia",  # "Kingdom of Bhutan
+    "BO": "South America",  # "Plurinational State of Bolivia
+    "BQ": "North America",  # '535'
+    "BA": "Europe",  # "Bosnia and Herzegovina
+    "BW": "Africa",  # "Republic of Botswana
+    "BV": "Antarctica",  # "Bouvet Island (Bouvetoya)
+    "BR": "South America",  # "Federative Republic of Brazil
+    "IO": "Asia",  # "British Indian Ocean Territory (Chagos Archipelago)
+    "VG": "North America",  # "British Virgin Islands
+    "BN": "Asia",  # "Brunei Darussalam
+    "BG": "Europe",  # "Republic of Bulgaria
+    "BF": "Africa",  # "Burkina Faso
+    "BI": "Africa",  # "Republic of Burundi
+    "KH": "Asia",  # "Kingdom of Cambodia
+    "CM": "Africa",  # "Republic of Cameroon
+    "CA": "North America",  # "Canada
+    "CV": "Africa",  # "Republic of Cape Verde
+    "KY": "North America",  # "Cayman Islands
+    "CF": "Africa",  # "Central African Republic
+    "TD": "Africa",  # "Republic of Chad
+    "CL": "South America",  # "Republic of Chile
+    "CN": "Asia",  # "People's Republic of China
+    "CX": "Asia",  # "Christmas Island
+    "CC": "Asia",  # "Cocos (Keeling) Islands
+    "CO": "South America",  # "Republic of Colombia
+    "KM": "Africa",  # "Union of the Comoros
+    "CD": "Africa",  # "Democratic Republic of the Congo
+    "CG": "Africa",  # "Republic of the Congo
+    "CK": "Oceania",  # "Cook Islands
+    "CR": "North America",  # "Republic of Costa Rica
+    "CI": "Africa",  # "Republic of Cote d'Ivoire
+    "HR": "Europe",  # "Republic of Croatia
+    "CU": "North America",  # "Republic of Cuba
+    "CW": "North America",  # "Curaçao
+    "CY": "Asia",  # "Republic of Cyprus
+    "CZ": "Europe",  # "Czech Republic
+    "DK": "Europe",  # "Kingdom of Denmark
+    "DJ": "Africa",  # "Republic of Djibouti
+    "DM": "North America",  # "Commonwealth of Dominica
+    "DO": "North America",  # "Dominican Republic
+    "EC": "South America",  # "Republic of Ecuador
+    "EG": "Africa",  # "Arab Republic of Egypt
+    "SV": "North America",  # "Republic of El Salvador
+    "GQ": "Africa",  # "Republic of Equatorial Guinea
+    "ER": "Africa",  # "State of Eritrea
+    "EE": "Europe",  # "Republic of Estonia
+    "ET": "Africa",  # "Federal Democratic Republic of Ethiopia
+    "FO": "Europe",  # "Faroe Islands
+    "FK": "South America",  # "Falkland Islands (Malvinas)
+    "FJ": "Oceania",  # "Republic of Fiji
+    "FI": "Europe",  # "Republic of Finland
+    "FR": "Europe",  # "French Republic
+    "GF": "South America",  # "French Guiana
+    "PF": "Oceania",  # "French Polynesia
+    "TF": "Antarctica",  # "French Southern Territories
+    "GA": "Africa",  # "Gabonese Republic
+    "GM": "Africa",  # "Republic of the Gambia
+    "GE": "Asia",  # "Georgia
+    "DE": "Europe",  # "Federal Republic of Germany
+    "GH": "Africa",  # "Republic of Ghana
+    "GI": "Europe",  # "Gibraltar
+    "GR": "Europe",  # "Hellenic Republic Greece
+    "GL": "North America",  # "Greenland
+    "GD": "North America",  # "Grenada
+    "GP": "North America",  # "Guadeloupe
+    "GU": "Oceania",  # "Guam
+    "GT": "North America",  # "Republic of Guatemala
+    "GG": "Europe",  # "Bailiwick of Guernsey
+    "GN": "Africa",  # "Republic of Guinea
+    "GW": "Africa",  # "Republic of Guinea-Bissau
+    "GY": "South America",  # "Co-operative Republic of Guyana
+    "HT": "North America",  # "Republic of Haiti
+    "HM": "Antarctica",  # "Heard Island and McDonald Islands
+    "VA": "Europe",  # "Holy See (Vatican City State)
+    "HN": "North America",  # "Republic of Honduras
+    "HK": "Asia",  # "Hong Kong Special Administrative Region of China
+    "HU": "Europe",  # "Hungary
+    "IS": "Europe",  # "Republic of Iceland
+    "IN": "Asia",  # "Republic of India
+    "ID": "Asia",  # "Republic of Indonesia
+    "IR": "Asia",  # "Islamic Republic of Iran
+    "IQ": "Asia",  # "Republic of Iraq
+    "IE": "Europe",  # "Ireland
+    "IM": "Europe",  # "Isle of Man
+    "IL": "Asia",  # "State of Israel
+    "IT": "Europe",  # "Italian Republic
+    "JM": "North America",  # "Jamaica
+    "JP": "Asia",  # "Japan
+    "JE": "Europe",  # "Bailiwick of Jersey
+    "JO": "Asia",  # "Hashemite Kingdom of Jordan
+    "KZ": "Asia",  # "Republic of Kazakhstan
+    "KE": "Africa",  # "Republic of Kenya
+    "KI": "Oceania",  # "Republic of Kiribati
+    "KP": "Asia",  # "Democratic People's Republic of Korea
+    "KR": "Asia",  # "Republic of Korea
+    "KW": "Asia",  # "State of Kuwait
+    "KG": "Asia",  # "Kyrgyz Republic
+    "LA": "Asia",  # "Lao People's Democratic Republic
+    "LV": "Europe",  # "Republic of Latvia
+    "LB": "Asia",  # "Lebanese Republic
+    "LS": "Africa",  # "Kingdom of Lesotho
+    "LR": "Africa",  # "Republic of Liberia
+    "LY": "Africa",  # "Libya
+    "LI": "Europe",  # "Principality of Liechtenstein
+    "LT": "Europe",  # "Republic of Lithuania
+    "LU": "Europe",  # "Grand Duchy of Luxembourg
+    "MO": "Asia",  # "Macao Special Administrative Region of China
+    "MK": "Europe",  # "Republic of Macedonia
+    "MG": "Africa",  # "Republic of Madagascar
+    "MW": "Africa",  # "Republic of Malawi
+    "MY": "Asia",  # "Malaysia
+    "MV": "Asia",  # "Republic of Maldives
+    "ML": "Africa",  # "Republic of Mali
+    "MT": "Europe",  # "Republic of Malta
+    "MH": "Oceania",  # "Republic of the Marshall Islands
+    "MQ": "North America",  # "Martinique
+    "MR": "Africa",  # "Islamic Republic of Mauritania
+    "MU": "Africa",  # "Republic of Mauritius
+    "YT": "Africa",  # "Mayotte
+    "MX": "North America",  # "United Mexican States
+    "FM": "Oceania",  # "Federated States of Micronesia
+    "MD": "Europe",  # "Republic of Moldova
+    "MC": "Europe",  # "Principality of Monaco
+    "MN": "Asia",  # "Mongolia
+    "ME": "Europe",  # "Montenegro
+    "MS": "North America",  # "Montserrat
+    "MA": "Africa",  # "Kingdom of Morocco
+    "MZ": "Africa",  # "Republic of Mozambique
+    "MM": "Asia",  # "Republic of the Union of Myanmar
+    "NA": "Africa",  # "Republic of Namibia
+    "NR": "Oceania",  # "Republic of Nauru
+    "NP": "Asia",  # "Federal Democratic Republic of Nepal
+    "NL": "Europe",  # "Kingdom of the Netherlands
+    "NC": "Oceania",  # "New Caledonia
+    "NZ": "Oceania",  # "New Zealand
+    "NI": "North America",  # "Republic of Nicaragua
+    "NE": "Africa",  # "Republic of Niger
+    "NG": "Africa",  # "Federal Republic of Nigeria
+    "NU": "Oceania",  # "Niue
+    "NF": "Oceania",  # "Norfolk Island
+    "MP": "Oceania",  # "Commonwealth of the Northern Mariana Islands
+    "NO": "Europe",  # "Kingdom of Norway
+    "OM": "Asia",  # "Sultanate of Oman
+    "PK": "Asia",  # "Islamic Republic of Pakistan
+    "PW": "Oceania",  # "Republic of Palau
+    "PS": "Asia",  # "Occupied Palestinian Territory
+    "PA": "North America",  # "Republic of Panama
+    "PG": "Oceania",  # "Independent State of Papua New Guinea
+    "PY": "South America",  # "Republic of Paraguay
+    "PE": "South America",  # "Republic of Peru
+    "PH": "Asia",  # "Republic of the Philippines
+    "PN": "Oceania",  # "Pitcairn Islands
+    "PL": "Europe",  # "Republic of Poland
+    "PT": "Europe",  # "Portuguese Republic
+    "PR": "North America",  # "Commonwealth of Puerto Rico
+    "QA": "Asia",  # "State of Qatar
+    "RE": "Africa",  # "Réunion
+    "RO": "Europe",  # "Romania
+    "RU": "Europe",  # "Russian Federation
+    "RW": "Africa",  # "Republic of Rwanda
+    "BL": "North America",  # "Saint Barthélemy
+    "SH": "Africa",  # '654'
+    "KN": "North America",  # "Federation of Saint Kitts and Nevis
+    "LC": "North America",  # "Saint Lucia
+    "MF": "North America",  # "Saint Martin (French part)
+    "PM": "North America",  # "Saint Pierre and Miquelon
+    "VC": "North America",  # "Saint Vincent and the Grenadines
+    "WS": "Oceania",  # "Independent State of Samoa
+    "SM": "Europe",  # "Republic of San Marino
+    "ST": "Africa",  # "Democratic Republic of Sao Tome and Principe
+    "SA": "Asia",  # "Kingdom of Saudi Arabia
+    "SN": "Africa",  # "Republic of Senegal
+    "RS": "Europe",  # "Republic of Serbia
+    "SC": "Africa",  # "Republic of Seychelles
+    "SL": "Africa",  # "Republic of Sierra Leone
+    "SG": "Asia",  # "Republic of Singapore
+    "SX": "North America",  # "Sint Maarten (Dutch part)
+    "SK": "Europe",  # "Slovakia (Slovak Republic)
+    "SI": "Europe",  # "Republic of Slovenia
+    "SB": "Oceania",  # "Solomon Islands
+    "SO": "Africa",  # "Somali Republic
+    "ZA": "Africa",  # "Republic of South Africa
+    "GS": "Antarctica",  # "South Georgia and the South Sandwich Islands
+    "SS": "Africa",  # "Republic of South Sudan
+    "ES": "Europe",  # "Kingdom of Spain
+    "LK": "Asia",  # "Democratic Socialist Republic of Sri Lanka
+    "SD": "Africa",  # "Republic of Sudan
+    "SR": "South America",  # "Republic of Suriname
+    "SJ": "Europe",  # "Svalbard & Jan Mayen Islands
+    "SZ": "Africa",  # "Kingdom of Swaziland
+    "SE": "Europe",  # "Kingdom of Sweden
+    "CH": "Europe",  # "Swiss Confederation
+    "SY": "Asia",  # "Syrian Arab Republic
+    "TW": "Asia",  # "Taiwan
+    "TJ": "Asia",  # "Republic of Tajikistan
+    "TZ": "Africa",  # "United Republic of Tanzania
+    "TH": "Asia",  # "Kingdom of Thailand
+    "TL": "Asia",  # "Democratic Republic of Timor-Leste
+    "TG": "Africa",  # "Togolese Republic
+    "TK": "Oceania",  # "Tokelau
+    "TO": "Oceania",  # "Kingdom of Tonga
+    "TT": "North America",  # "Republic of Trinidad and Tobago
+    "TN": "Africa",  # "Tunisian Republic
+    "TR": "Asia",  # "Republic of Turkey
+    "TM": "Asia",  # "Turkmenistan
+    "TC": "North America",  # "Turks and Caicos Islands
+    "TV": "Oceania",  # "Tuvalu
+    "UG": "Africa",  # "Republic of Uganda
+    "UA": "Europe",  # "Ukraine
+    "AE": "Asia",  # "United Arab Emirates
+    "GB": "Europe",  # "United Kingdom of Great Britain & Northern Ireland
+    "US": "North America",  # "United States of America
+    "UM": "Oceania",  # "United States Minor Outlying Islands
+    "VI": "North America",  # "United States Virgin Islands
+    "UY": "South America",  # "Eastern Republic of Uruguay
+    "UZ": "Asia",  # "Republic of Uzbekistan
+    "VU": "Oceania",  # "Republic of Vanuatu
+    "VE": "South America",  # "Bolivarian Republic of Venezuela
+    "VN": "Asia",  # "Socialist Republic of Vietnam
+    "WF": "Oceania",  # "Wallis and Futuna
+    "EH": "Africa",  # "Western Sahara
+    "YE": "Asia",  # "Yemen
+    "ZM": "Africa",  # "Republic of Zambia
+    "ZW": "Africa"  # "Republic of Zimbabwe
+}
+
+GENBANK_TO_GISAID_COUNTRY_MAP = {
+    "UnitedStates":"USA",
+    "Myanmar(Burma)":"Myanmar",
+    "U.S.VirginIslands":"USA",
+    "Czechia":"Czech Republic",
+    "Bahrein":"Bahrain",
+    "Macedonia":"NorthMacedonia"
+}
 
 def memoize(f):
     memos_stored = {}
@@ -19,12 +362,68 @@ def memoize(f):
         return memos_stored[x]
     return helper
 
+country_name_snapshot = {}
+def load_country_name_snapshot():
+    """
+     Load the precomputed alpha-3 -> country name table, once per process.
+     Returns None if the snapshot file is missing, in which case names are looked up with pycountry.
+    """
+    if not country_name_snapshot:
+        try:
+            with open(COUNTRY_NAME_SNAPSHOT_FILE, "r", encoding="utf-8") as snapshot_file:
+                country_name_snapshot.update(json.load(snapshot_file))
+        except FileNotFoundError:
+            print("Country name snapshot %s not found; using pycountry." % COUNTRY_NAME_SNAPSHOT_FILE, file=sys.stderr)
+            country_name_snapshot["country_name_for_alpha_3"] = None
+    return country_name_snapshot["country_name_for_alpha_3"]
+
+def write_country_name_snapshot(snapshot_path=COUNTRY_NAME_SNAPSHOT_FILE):
+    """
+     Write the alpha-3 -> country name (no spaces) table from the installed pycountry to a compact json snapshot,
+     recording the pycountry version used. Run by the Dockerfile after installing requirements, so the snapshot
+     always matches the image's pycountry; locally, run it again after upgrading pycountry:
+         python3 -c "import genbank_dump; genbank_dump.write_country_name_snapshot()"
+    """
+    import pycountry
+
+    snapshot = {
+        "pycountry_version": getattr(pycountry, "__version__", "unknown"),
+        "country_name_for_alpha_3": {country.alpha_3.upper(): country.name.replace(" ","") for country in pycountry.countries}
+    }
+    with open(snapshot_path, "w", encoding="utf-8") as snapshot_file:
+        json.dump(snapshot, snapshot_file, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+def get_seconds_since_process_start():
+    """
+     Get the time elapsed since this process started, including interpreter startup and imports.
+     Read from /proc on Linux (to the kernel's clock tick); elsewhere, measured from when this module was loaded.
+    """
+    try:
+        with open("/proc/self/stat", "r") as stat_file:
+            # fields after the parenthesized command name; starttime is field 22 of the whole line
+            start_ticks = int(stat_file.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.perf_counter() - PROCESS_START_TIME
+
+def report_time_to_first_record(first_record_written):
+    """Print the --startup_profile report, once the first record is written or the run produced none."""
+
+    if first_record_written:
+        print("Time to first record: %.3f s" % get_seconds_since_process_start())
+    else:
+        print("Time to first record: no records (run finished after %.3f s)" % get_seconds_since_process_start())
+
 def make_gmaps_client(api_key_file):
     """Create google maps client with api_key."""
 
     with open(api_key_file, "r") as key_file:
         api_key = key_file.readline()
 
+    import googlemaps
+
     gmaps = googlemaps.Client(key=api_key)
 
     return gmaps
@@ -33,259 +432,7 @@ def get_continent(gmaps_response):
     """Get the continent for a two-letter country code."""
     # with the above scheme, we can't get the continent if the country is unknown (ex. contested territories)
 
-    continent_for_country = {  # see https://gist.github.com/nobuti/3816985
-                                "AF": "Asia",  # "Islamic Republic of Afghanistan
-                                "AX": "Europe",  # "Åland Islands
-                                "AL": "Europe",  # "Republic of Albania
-                                "DZ": "Africa",  # "People's Democratic Republic of Algeria
-                                "AS": "Oceania",  # "American Samoa
-                                "AD": "Europe",  # "Principality of Andorra
-                                "AO": "Africa",  # "Republic of Angola
-                                "AI": "North America",  # "Anguilla
-                                "AQ": "Antarctica",  # "Antarctica (the territory South of 60 deg S)
-                                "AG": "North America",  # "Antigua and Barbuda
-                                "AR": "South America",  # "Argentine Republic
-                                "AM": "Asia",  # "Republic of Armenia
-                                "AW": "North America",  # "Aruba
-                                "AU": "Oceania",  # "Commonwealth of Australia
-                                "AT": "Europe",  # "Republic of Austri
-                                "AZ": "Asia",  # "Republic of Azerbaijan
-                                "BS": "North America",  # "Commonwealth of the Bahamas
-                                "BH": "Asia",  # "Kingdom of Bahrain
-                                "BD": "Asia",  # "People's Republic of Bangladesh
-                                "BB": "North America",  # "Barbados
-                                "BY": "Europe",  # "Republic of Belarus
-                                "BE": "Europe",  # "Kingdom of Belgium
-                                "BZ": "North America",  # "Belize
-                                "BJ": "Africa",  # "Republic of Benin
-                                "BM": "North America",  # "Bermuda
-                                "BT": "Asia",  # "Kingdom of Bhutan
-                                "BO": "South America",  # "Plurinational State of Bolivia
-                                "BQ": "North America",  # '535'
-                                "BA": "Europe",  # "Bosnia and Herzegovina
-                                "BW": "Africa",  # "Republic of Botswana
-                                "BV": "Antarctica",  # "Bouvet Island (Bouvetoya)
-                                "BR": "South America",  # "Federative Republic of Brazil
-                                "IO": "Asia",  # "British Indian Ocean Territory (Chagos Archipelago)
-                                "VG": "North America",  # "British Virgin Islands
-                                "BN": "Asia",  # "Brunei Darussalam
-                                "BG": "Europe",  # "Republic of Bulgaria
-                                "BF": "Africa",  # "Burkina Faso
-                                "BI": "Africa",  # "Republic of Burundi
-                                "KH": "Asia",  # "Kingdom of Cambodia
-                                "CM": "Africa",  # "Republic of Cameroon
-                                "CA": "North America",  # "Canada
-                                "CV": "Africa",  # "Republic of Cape Verde
-                                "KY": "North America",  # "Cayman Islands
-                                "CF": "Africa",  # "Central African Republic
-                                "TD": "Africa",  # "Republic of Chad
-                                "CL": "South America",  # "Republic of Chile
-                                "CN": "Asia",  # "People's Republic of China
-                                "CX": "Asia",  # "Christmas Island
-                                "CC": "Asia",  # "Cocos (Keeling) Islands
-                                "CO": "South America",  # "Republic of Colombia
-                                "KM": "Africa",  # "Union of the Comoros
-                                "CD": "Africa",  # "Democratic Republic of the Congo
-                                "CG": "Africa",  # "Republic of the Congo
-                                "CK": "Oceania",  # "Cook Islands
-                                "CR": "North America",  # "Republic of Costa Rica
-                                "CI": "Africa",  # "Republic of Cote d'Ivoire
-                                "HR": "Europe",  # "Republic of Croatia
-                                "CU": "North America",  # "Republic of Cuba
-                                "CW": "North America",  # "Curaçao
-                                "CY": "Asia",  # "Republic of Cyprus
-                                "CZ": "Europe",  # "Czech Republic
-                                "DK": "Europe",  # "Kingdom of Denmark
-                                "DJ": "Africa",  # "Republic of Djibouti
-                                "DM": "North America",  # "Commonwealth of Dominica
-                                "DO": "North America",  # "Dominican Republic
-                                "EC": "South America",  # "Republic of Ecuador
-                                "EG": "Africa",  # "Arab Republic of Egypt
-                                "SV": "North America",  # "Republic of El Salvador
-                                "GQ": "Africa",  # "Republic of Equatorial Guinea
-                                "ER": "Africa",  # "State of Eritrea
-                                "EE": "Europe",  # "Republic of Estonia
-                                "ET": "Africa",  # "Federal Democratic Republic of Ethiopia
-                                "FO": "Europe",  # "Faroe Islands
-                                "FK": "South America",  # "Falkland Islands (Malvinas)
-                                "FJ": "Oceania",  # "Republic of Fiji
-                                "FI": "Europe",  # "Republic of Finland
-                                "FR": "Europe",  # "French Republic
-                                "GF": "South America",  # "French Guiana
-                                "PF": "Oceania",  # "French Polynesia
-                                "TF": "Antarctica",  # "French Southern Territories
-                                "GA": "Africa",  # "Gabonese Republic
-                                "GM": "Africa",  # "Republic of the Gambia
-                                "GE": "Asia",  # "Georgia
-                                "DE": "Europe",  # "Federal Republic of Germany
-                                "GH": "Africa",  # "Republic of Ghana
-                                "GI": "Europe",  # "Gibraltar
-                                "GR": "Europe",  # "Hellenic Republic Greece
-                                "GL": "North America",  # "Greenland
-                                "GD": "North America",  # "Grenada
-                                "GP": "North America",  # "Guadeloupe
-                                "GU": "Oceania",  # "Guam
-                                "GT": "North America",  # "Republic of Guatemala
-                                "GG": "Europe",  # "Bailiwick of Guernsey
-                                "GN": "Africa",  # "Republic of Guinea
-                                "GW": "Africa",  # "Republic of Guinea-Bissau
-                                "GY": "South America",  # "Co-operative Republic of Guyana
-                                "HT": "North America",  # "Republic of Haiti
-                                "HM": "Antarctica",  # "Heard Island and McDonald Islands
-                                "VA": "Europe",  # "Holy See (Vatican City State)
-                                "HN": "North America",  # "Republic of Honduras
-                                "HK": "Asia",  # "Hong Kong Special Administrative Region of China
-                                "HU": "Europe",  # "Hungary
-                                "IS": "Europe",  # "Republic of Iceland
-                                "IN": "Asia",  # "Republic of India
-                                "ID": "Asia",  # "Republic of Indonesia
-                                "IR": "Asia",  # "Islamic Republic of Iran
-                                "IQ": "Asia",  # "Republic of Iraq
-                                "IE": "Europe",  # "Ireland
-                                "IM": "Europe",  # "Isle of Man
-                                "IL": "Asia",  # "State of Israel
-                                "IT": "Europe",  # "Italian Republic
-                                "JM": "North America",  # "Jamaica
-                                "JP": "Asia",  # "Japan
-                                "JE": "Europe",  # "Bailiwick of Jersey
-                                "JO": "Asia",  # "Hashemite Kingdom of Jordan
-                                "KZ": "Asia",  # "Republic of Kazakhstan
-                                "KE": "Africa",  # "Republic of Kenya
-                                "KI": "Oceania",  # "Republic of Kiribati
-                                "KP": "Asia",  # "Democratic People's Republic of Korea
-                                "KR": "Asia",  # "Republic of Korea
-                                "KW": "Asia",  # "State of Kuwait
-                                "KG": "Asia",  # "Kyrgyz Republic
-                                "LA": "Asia",  # "Lao People's Democratic Republic
-                                "LV": "Europe",  # "Republic of Latvia
-                                "LB": "Asia",  # "Lebanese Republic
-                                "LS": "Africa",  # "Kingdom of Lesotho
-                                "LR": "Africa",  # "Republic of Liberia
-                                "LY": "Africa",  # "Libya
-                                "LI": "Europe",  # "Principality of Liechtenstein
-                                "LT": "Europe",  # "Republic of Lithuania
-                                "LU": "Europe",  # "Grand Duchy of Luxembourg
-                                "MO": "Asia",  # "Macao Special Administrative Region of China
-                                "MK": "Europe",  # "Republic of Macedonia
-                                "MG": "Africa",  # "Republic of Madagascar
-                                "MW": "Africa",  # "Republic of Malawi
-                                "MY": "Asia",  # "Malaysia
-                                "MV": "Asia",  # "Republic of Maldives
-                                "ML": "Africa",  # "Republic of Mali
-                                "MT": "Europe",  # "Republic of Malta
-                                "MH": "Oceania",  # "Republic of the Marshall Islands
-                                "MQ": "North America",  # "Martinique
-                                "MR": "Africa",  # "Islamic Republic of Mauritania
-                                "MU": "Africa",  # "Republic of Mauritius
-                                "YT": "Africa",  # "Mayotte
-                                "MX": "North America",  # "United Mexican States
-                                "FM": "Oceania",  # "Federated States of Micronesia
-                                "MD": "Europe",  # "Republic of Moldova
-                                "MC": "Europe",  # "Principality of Monaco
-                                "MN": "Asia",  # "Mongolia
-                                "ME": "Europe",  # "Montenegro
-                                "MS": "North America",  # "Montserrat
-                                "MA": "Africa",  # "Kingdom of Morocco
-                                "MZ": "Africa",  # "Republic of Mozambique
-                                "MM": "Asia",  # "Republic of the Union of Myanmar
-                                "NA": "Africa",  # "Republic of Namibia
-                                "NR": "Oceania",  # "Republic of Nauru
-                                "NP": "Asia",  # "Federal Democratic Republic of Nepal
-                                "NL": "Europe",  # "Kingdom of the Netherlands
-                                "NC": "Oceania",  # "New Caledonia
-                                "NZ": "Oceania",  # "New Zealand
-                                "NI": "North America",  # "Republic of Nicaragua
-                                "NE": "Africa",  # "Republic of Niger
-                                "NG": "Africa",  # "Federal Republic of Nigeria
-                                "NU": "Oceania",  # "Niue
-                                "NF": "Oceania",  # "Norfolk Island
-                                "MP": "Oceania",  # "Commonwealth of the Northern Mariana Islands
-                                "NO": "Europe",  # "Kingdom of Norway
-                                "OM": "Asia",  # "Sultanate of Oman
-                                "PK": "Asia",  # "Islamic Republic of Pakistan
-                                "PW": "Oceania",  # "Republic of Palau
-                                "PS": "Asia",  # "Occupied Palestinian Territory
-                                "PA": "North America",  # "Republic of Panama
-                                "PG": "Oceania",  # "Independent State of Papua New Guinea
-                                "PY": "South America",  # "Republic of Paraguay
-                                "PE": "South America",  # "Republic of Peru
-                                "PH": "Asia",  # "Republic of the Philippines
-                                "PN": "Oceania",  # "Pitcairn Islands
-                                "PL": "Europe",  # "Republic of Poland
-                                "PT": "Europe",  # "Portuguese Republic
-                                "PR": "North America",  # "Commonwealth of Puerto Rico
-                                "QA": "Asia",  # "State of Qatar
-                                "RE": "Africa",  # "Réunion
-                                "RO": "Europe",  # "Romania
-                                "RU": "Europe",  # "Russian Federation
-                                "RW": "Africa",  # "Republic of Rwanda
-                                "BL": "North America",  # "Saint Barthélemy
-                                "SH": "Africa",  # '654'
-                                "KN": "North America",  # "Federation of Saint Kitts and Nevis
-                                "LC": "North America",  # "Saint Lucia
-                                "MF": "North America",  # "Saint Martin (French part)
-                                "PM": "North America",  # "Saint Pierre and Miquelon
-                                "VC": "North America",  # "Saint Vincent and the Grenadines
-                                "WS": "Oceania",  # "Independent State of Samoa
-                                "SM": "Europe",  # "Republic of San Marino
-                                "ST": "Africa",  # "Democratic Republic of Sao Tome and Principe
-                                "SA": "Asia",  # "Kingdom of Saudi Arabia
-                                "SN": "Africa",  # "Republic of Senegal
-                                "RS": "Europe",  # "Republic of Serbia
-                                "SC": "Africa",  # "Republic of Seychelles
-                                "SL": "Africa",  # "Republic of Sierra Leone
-                                "SG": "Asia",  # "Republic of Singapore
-                                "SX": "North America",  # "Sint Maarten (Dutch part)
-                                "SK": "Europe",  # "Slovakia (Slovak Republic)
-                                "SI": "Europe",  # "Republic of Slovenia
-                                "SB": "Oceania",  # "Solomon Islands
-                                "SO": "Africa",  # "Somali Republic
-                                "ZA": "Africa",  # "Republic of South Africa
-                                "GS": "Antarctica",  # "South Georgia and the South Sandwich Islands
-                                "SS": "Africa",  # "Republic of South Sudan
-                                "ES": "Europe",  # "Kingdom of Spain
-                                "LK": "Asia",  # "Democratic Socialist Republic of Sri Lanka
-                                "SD": "Africa",  # "Republic of Sudan
-                                "SR": "South America",  # "Republic of Suriname
-                                "SJ": "Europe",  # "Svalbard & Jan Mayen Islands
-                                "SZ": "Africa",  # "Kingdom of Swaziland
-                                "SE": "Europe",  # "Kingdom of Sweden
-                                "CH": "Europe",  # "Swiss Confederation
-                                "SY": "Asia",  # "Syrian Arab Republic
-                                "TW": "Asia",  # "Taiwan
-                                "TJ": "Asia",  # "Republic of Tajikistan
-                                "TZ": "Africa",  # "United Republic of Tanzania
-                                "TH": "Asia",  # "Kingdom of Thailand
-                                "TL": "Asia",  # "Democratic Republic of Timor-Leste
-                                "TG": "Africa",  # "Togolese Republic
-                                "TK": "Oceania",  # "Tokelau
-                                "TO": "Oceania",  # "Kingdom of Tonga
-                                "TT": "North America",  # "Republic of Trinidad and Tobago
-                                "TN": "Africa",  # "Tunisian Republic
-                                "TR": "Asia",  # "Republic of Turkey
-                                "TM": "Asia",  # "Turkmenistan
-                                "TC": "North America",  # "Turks and Caicos Islands
-                                "TV": "Oceania",  # "Tuvalu
-                                "UG": "Africa",  # "Republic of Uganda
-                                "UA": "Europe",  # "Ukraine
-                                "AE": "Asia",  # "United Arab Emirates
-                                "GB": "Europe",  # "United Kingdom of Great Britain & Northern Ireland
-                                "US": "North America",  # "United States of America
-                                "UM": "Oceania",  # "United States Minor Outlying Islands
-                                "VI": "North America",  # "United States Virgin Islands
-                                "UY": "South America",  # "Eastern Republic of Uruguay
-                                "UZ": "Asia",  # "Republic of Uzbekistan
-                                "VU": "Oceania",  # "Republic of Vanuatu
-                                "VE": "South America",  # "Bolivarian Republic of Venezuela
-                                "VN": "Asia",  # "Socialist Republic of Vietnam
-                                "WF": "Oceania",  # "Wallis and Futuna
-                                "EH": "Africa",  # "Western Sahara
-                                "YE": "Asia",  # "Yemen
-                                "ZM": "Africa",  # "Republic of Zambia
-                                "ZW": "Africa"  # "Republic of Zimbabwe
-    }
-
-    return continent_for_country.get(get_country(gmaps_response, short_name=True), "NA")
+    return CONTINENT_FOR_COUNTRY.get(get_country(gmaps_response, short_name=True), "NA")
 
 def get_full_country_name(country_abbrv):
     """
@@ -293,7 +440,14 @@ def get_full_country_name(country_abbrv):
      See: https://en.wikipedia.org/wiki/ISO_3166-1_alpha-3
           https://www.iso.org/obp/ui/#search
     """
+    country_names = load_country_name_snapshot()
+    if country_names is not None:
+        # the snapshot holds every alpha-3 code known to the pycountry version that built it (see "pycountry_version"),
+        # keyed in upper case because pycountry's own lookup ignores case
+        return country_names.get(country_abbrv.upper(), country_abbrv)
+
     try:
+        import pycountry
         return pycountry.countries.get(alpha_3=country_abbrv).name.replace(" ","")
     except Exception as e:
         return country_abbrv
@@ -301,16 +455,7 @@ def get_full_country_name(country_abbrv):
 @memoize
 def rename_country_to_gisaid_version(country):
 
-    genbank_to_gisaid_map = {
-        "UnitedStates":"USA",
-        "Myanmar(Burma)":"Myanmar",
-        "U.S.VirginIslands":"USA",
-        "Czechia":"Czech Republic",
-        "Bahrein":"Bahrain",
-        "Macedonia":"NorthMacedonia"
-    }
-
-    return genbank_to_gisaid_map.get(country.replace(" ",""),country)
+    return GENBANK_TO_GISAID_COUNTRY_MAP.get(country.replace(" ",""),country)
 
 def get_loc_category(gmaps_response):
     """If location level for geocoded loc matches one in highlight list, return short name, else return None."""
@@ -414,15 +559,156 @@ def remove_strain_prefix(strain, country=None, gisaid_style=True):
     except Exception as e:
         return strain
 
+def open_spill_db(db_path, cache_bytes):
+    """Open a sqlite database used only as scratch space, with its page cache limited to cache_bytes."""
+
+    import sqlite3
+
+    db = sqlite3.connect(db_path, isolation_level=None)
+    # contents are rebuilt on every run, so skip journaling and fsync
+    db.execute("PRAGMA journal_mode=OFF")
+    db.execute("PRAGMA synchronous=OFF")
+    db.execute("PRAGMA cache_size=-%d" % max(cache_bytes // 1024, 64))
+    return db
+
+class DiskBackedStrainSet(object):
+    """
+     Set of strain IDs stored in sqlite, with an in-memory Bloom filter in front
+     so that lookups of strains not seen before rarely need to touch the disk.
+     The filter is sized for expected_count strains at false_positive_rate, capped at max_bloom_filter_bytes;
+     the number of hashes is chosen for the size the filter actually gets.
+    """
+
+    def __init__(self, db_path, expected_count, false_positive_rate, max_bloom_filter_bytes, cache_bytes):
+        import hashlib
+        import math
+
+        self.blake2b = hashlib.blake2b
+        # optimal bit count m = -n ln(p) / ln(2)^2 and, for the m left after the cap, hash count k = (m / n) ln(2)
+        expected_count = max(expected_count, 1)
+        bit_count = int(math.ceil(-expected_count * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.bloom_filter = bytearray(max(min((bit_count + 7) // 8, max_bloom_filter_bytes), 1))
+        self.bit_count = len(self.bloom_filter) * 8
+        self.hash_count = max(int(round(self.bit_count / float(expected_count) * math.log(2))), 1)
+        self.db = open_spill_db(db_path, cache_bytes)
+        self.db.execute("CREATE TABLE IF NOT EXISTS strains (strain TEXT PRIMARY KEY) WITHOUT ROWID")
+
+    def _bit_positions(self, strain):
+        # double hashing: derive hash_count bit positions from two 64-bit hashes
+        digest = self.blake2b(strain.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bit_count for i in range(self.hash_count)]
+
+    def __contains__(self, strain):
+        for pos in self._bit_positions(strain):
+            if not self.bloom_filter[pos >> 3] & (1 << (pos & 7)):
+                return False
+        # possible false positive from the Bloom filter; confirm on disk
+        return self.db.execute("SELECT 1 FROM strains WHERE strain = ?", (strain,)).fetchone() is not None
+
+    def add(self, strain):
+        for pos in self._bit_positions(strain):
+            self.bloom_filter[pos >> 3] |= 1 << (pos & 7)
+        self.db.execute("INSERT OR IGNORE INTO strains VALUES (?)", (strain,))
+
+    def close(self):
+        self.db.close()
+
+class DiskBackedDict(object):
+    """
+     Dictionary stored in sqlite as json, with the lru_size most recently used entries kept in memory.
+     items() goes straight from disk, in sorted key order.
+    """
+
+    def __init__(self, db_path, lru_size, cache_bytes):
+        self.lru = OrderedDict()
+        self.lru_size = max(lru_size, 1)
+        self.db = open_spill_db(db_path, cache_bytes)
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID")
+
+    def _remember(self, key, value):
+        self.lru[key] = value
+        self.lru.move_to_end(key)
+        if len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def __contains__(self, key):
+        if key in self.lru:
+            return True
+        return self.db.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    def __getitem__(self, key):
+        if key in self.lru:
+            self.lru.move_to_end(key)
+            return self.lru[key]
+        row = self.db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        value = json.loads(row[0])
+        self._remember(key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?)", (key, json.dumps(value)))
+        self._remember(key, value)
+
+    def items(self):
+        for key, value in self.db.execute("SELECT key, value FROM entries ORDER BY key"):
+            yield key, json.loads(value)
+
+    def close(self):
+        self.db.close()
+
+def make_bounded_memory_stores(max_memory_mb, spill_dir, expected_strain_count=EXPECTED_STRAIN_COUNT):
+    """
+     Return (strain_ids_seen, geocode_memo) stores for curate_records that keep their in-memory part
+     within roughly max_memory_mb, spilling the rest to spill_dir.
+    """
+
+    budget_bytes = max_memory_mb * 1024 * 1024
+    # the Bloom filter is sized from the expected strain count, and only capped at a quarter of the budget;
+    # an eighth goes to the geocode LRU cache and a sixteenth to each sqlite page cache,
+    # leaving the rest for the interpreter and the current row
+    lru_size = (budget_bytes // 8) // GEOCODE_ENTRY_BYTES
+    cache_bytes = budget_bytes // 16
+
+    strain_ids_seen = DiskBackedStrainSet(os.path.join(spill_dir, "strain_ids_seen.sqlite"),
+                                          expected_strain_count, BLOOM_FILTER_FALSE_POSITIVE_RATE,
+                                          budget_bytes // 4, cache_bytes)
+    geocode_memo = DiskBackedDict(os.path.join(spill_dir, "geocode_memo.sqlite"), lru_size, cache_bytes)
+
+    return strain_ids_seen, geocode_memo
+
+def iter_geocoded_locations(geocode_memo):
+    """Yield (location, geocode) for each successfully geocoded location in geocode_memo, sorted by location."""
+
+    # a DiskBackedDict already yields its items in sorted order, straight from disk
+    items = geocode_memo.items() if isinstance(geocode_memo, DiskBackedDict) else sorted(geocode_memo.items())
+    for location, loc in items:
+        if loc is not None:
+            yield location, loc
+
+def get_peak_rss_mb():
+    """Get the peak resident set size of this process so far, in MB."""
+    import resource
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS, kilobytes on Linux
+    return peak_rss / (1024.0 * 1024.0) if sys.platform == "darwin" else peak_rss / 1024.0
+
 memo = {}
 def memoize_geocode(f):
-    def helper(x, y):
-        if x not in memo:
-            memo[x] = f(x, y)
+    def helper(x, y, geocode_memo=None):
+        # geocode_memo may be any dict-like store; the module-level memo is used if not given
+        if geocode_memo is None:
+            geocode_memo = memo
+        if x not in geocode_memo:
+            geocode_memo[x] = f(x, y)
         else:
             # print("cache hit!",x)
             pass
-        return memo[x]
+        return geocode_memo[x]
     return helper
 
 @memoize_geocode
@@ -457,11 +743,18 @@ def geocode_location(location_str, gmaps_client):
             }
 
 
-def write_tsv_files(response_content, gmaps_client, 
-                    normalize_homo_sapiens_to_human=True, 
-                    normalize_country_names_to_gisaid=True, 
-                    normalize_strain_name=True):
-    """Write out tsv files."""
+def curate_records(response_content, gmaps_client, geocode_memo,
+                   normalize_homo_sapiens_to_human=True,
+                   normalize_country_names_to_gisaid=True,
+                   normalize_strain_name=True,
+                   strain_ids_seen=None):
+    """
+     Yield (metadata, sequence) for each curated record, caching geocoded locations (None if geocoding failed) in geocode_memo.
+     sequence is None if the sequence column was not requested from NCBI.
+     strain_ids_seen may be any object supporting "in" and add(); a new set is used if not given.
+    """
+
+    import dateutil.parser
 
     # set standard values
     VIRUS_COL = "ncov"  # value for the "virus" column of output
@@ -471,188 +764,313 @@ def write_tsv_files(response_content, gmaps_client,
     placeholder_date_vals = datetime.strptime('01/01/01', '%m/%d/%y')
 
     # field names for csv
-    fields_to_write = OrderedDict([
-        ("strain", None),
-        ("virus", None),
-        ("gisaid_epi_isl", None),
-        ("genbank_accession", None),
-        ("database", None),
-        ("date", None),
-        ("region", None),
-        ("country", None),
-        ("division", None),
-        ("location", None),
-        ("gb_raw_location", None),
-        ("geocode_precision", None),
-        ("region_exposure", None),
-        ("country_exposure", None),
-        ("division_exposure", None),
-        ("length", None),
-        ("host", None),
-        ("age", None),
-        ("sex", None),
-        ("originating_lab", None),
-        ("submitting_lab", None),
-        ("date_submitted", None),
-        ("biosample_accession", None),
-        ("geocat", None),
-        ("authors", None),
-        ("url", None),
-        ("title", None)
-    ])
+    fields_to_write = OrderedDict((field, None) for field in METADATA_FIELDS)
 
-    # instantiate dictionary to hold all location info until write to file
-    memo = {}
     # set to store strain IDs to ensure uniquness
-    strain_ids_seen = set()
+    if strain_ids_seen is None:
+        strain_ids_seen = set()
+    for idx, row in enumerate(csv.DictReader(response_content)):
+        # if location is null, continue to the next sequence
+        # (call_ncbi already asks NCBI for records with a location; this is a backstop)
+        if len(row["location"]) == 0:
+            continue
+
+        loc = geocode_location(row["location"], gmaps_client, geocode_memo)
+        if loc is None:
+            continue
+        
+
+        if row["host"] == "Homo sapiens" and normalize_homo_sapiens_to_human:
+            host = "Human"
+        else:
+            host = row["host"].replace(" ", "-")
+
+        #if idx==100:
+        #    exit(0)
+        
+        country = rename_country_to_gisaid_version(loc["country"]) if normalize_country_names_to_gisaid and loc["country"] is not None else loc["country"]
+
+        geolocale_for_strain = country
+        if normalize_country_names_to_gisaid and geolocale_for_strain is not None:
+            # GISAID uses country names for most places, but uses provinces for China and England/Scotland/Wales/et al. for the UK
+            # we should map accordingly to handle these exceptions
+            if geolocale_for_strain == "China":
+                if len(loc["division"])>1 and loc["division"] != geolocale_for_strain:
+                    geolocale_for_strain = loc["division"]
+                    if len(loc["location"])>1 and loc["location"] != geolocale_for_strain:
+                        geolocale_for_strain = loc["location"]
+            if geolocale_for_strain.replace(" ","") == "UnitedKingdom":
+                if len(loc["division"])>1 and loc["division"] != geolocale_for_strain:
+                    geolocale_for_strain = loc["division"]
+
+        try:
+            collection_date = dateutil.parser.parse(row["collected"], default=placeholder_date_vals).strftime('%Y-%m-%d')  # parse().isoformat()
+            collection_year = collection_date.split("-")[0] # split ISO8601 date
+        except Exception as e:
+            print('Skipping due to missing or unparsable date: ', row["genbank_accession"])
+            continue
+        
+        # try to use GIDAID-style strain information, if provided
+        if row["strain"] is not None and row["strain"] != "":
+            strain = row["strain"]
+            strain = remove_strain_prefix(strain,geolocale_for_strain,gisaid_style=normalize_country_names_to_gisaid) if normalize_strain_name else strain
+            
+            #strain_parts = re.split(r'[^/]+',strain,maxsplit=3)
+            m=re.match(r'(.*)/(.*)/(.*)',strain)
+            if not m or m.group(2) is None:
+                #print("assembling")
+                strain = "{country}/{strain}/{collection_year}".format(country=geolocale_for_strain,strain=strain,collection_year=collection_year) # use accession as placeholder for strain ID
+            #print(strain)
+        else:
+            strain = "{country}/{genbank_accession}/{collection_year}".format(country=geolocale_for_strain,genbank_accession=row["genbank_accession"],collection_year=collection_year) # use accession as placeholder for strain ID
+
+        strain = strain.replace(" ","")
+
+        # None when sequences were not requested from NCBI (metadata-only runs)
+        sequence = row.get("sequence")
+
+        # for SARS-CoV-2 only
+        if VIRUS_COL == "ncov":
+            # if using GISAID-style strain IDs, enforce name format exception used for reference sequence
+            # that is hard-coded and expected by nextstrain
+            # see: https://github.com/nextstrain/ncov/blob/master/defaults/include.txt
+            strain = strain.replace("China/Wuhan-Hu-1/2019", "Wuhan/Hu-1/2019")
+
+        # if we have seen this strain before, continue to the next record
+        # this enforces a uniqeness constraint on strain IDs
+        # which is helpful because duplicates can be present on GenBank
+        # in the case of a GenBank sequence and the RefSeq designated equivalent of the same
+        if strain in strain_ids_seen:
+            continue
+        else:
+            # otherwise add the strain to those we have seen before
+            strain_ids_seen.add(strain)
+
+
+        fields_to_write["strain"] = strain # +"|"+row["genbank_accession"]
+        fields_to_write["virus"] = VIRUS_COL
+        fields_to_write["gisaid_epi_isl"] = None
+        fields_to_write["genbank_accession"] = row["genbank_accession"]
+        fields_to_write["database"] = row["database"]
+        fields_to_write["date"] = collection_date
+        fields_to_write["region"] = loc["continent"]
+        fields_to_write["country"] = country
+        fields_to_write["division"] = loc["division"]
+        fields_to_write["location"] = loc["location"]
+        fields_to_write["gb_raw_location"] = row["location"]
+        fields_to_write["geocode_precision"] = loc["location_precision"][0]
+        fields_to_write["region_exposure"] = loc["continent"]  # should perhaps be set to None
+        fields_to_write["country_exposure"] = loc["country"]  # should perhaps be set to None
+        fields_to_write["division_exposure"] = loc["location"]  # should perhaps be set to None
+        if sequence is not None:
+            fields_to_write["length"] = len(sequence)
+        else:
+            fields_to_write["length"] = int(row["length"]) if row.get("length") else None
+        fields_to_write["host"] = host
+        fields_to_write["age"] = None
+        fields_to_write["sex"] = None
+        fields_to_write["originating_lab"] = None
+        fields_to_write["submitting_lab"] = None
+        fields_to_write["date_submitted"] = dateutil.parser.parse(row["submitted"], default=placeholder_date_vals).strftime('%Y-%m-%d')  # parse().isoformat()
+        fields_to_write["biosample_accession"] = row["biosample_accession"]
+        fields_to_write["geocat"] = loc["loc_category"]
+        fields_to_write["authors"] = row["authors"]
+        fields_to_write["url"] = None
+        fields_to_write["title"] = row["title"]
+
+        yield {key: "NA" if (val is None or val == "") else val for key, val in fields_to_write.items()}, sequence
+
+        if (idx + 1) % 100 == 0:
+            print("Found data for %s seqs" % (idx + 1))
+
+        # to dump reply from GenBank
+        # print(json.dumps(row, allow_nan = False, indent = None, separators = ',:'))
+
+        # to halt after so many records
+        if RETURN_COUNT_LIMIT is not None:
+            if idx >= RETURN_COUNT_LIMIT - 1:
+                break
+
+
+def write_tsv_files(response_content, gmaps_client, 
+                    normalize_homo_sapiens_to_human=True, 
+                    normalize_country_names_to_gisaid=True, 
+                    normalize_strain_name=True,
+                    startup_profile=False,
+                    geocode_memo=None,
+                    strain_ids_seen=None):
+    """Write out tsv files."""
+
+    # instantiate dictionary to hold all location info until write to file
+    memo = {} if geocode_memo is None else geocode_memo
+    records = curate_records(response_content, gmaps_client, memo,
+                             normalize_homo_sapiens_to_human=normalize_homo_sapiens_to_human,
+                             normalize_country_names_to_gisaid=normalize_country_names_to_gisaid,
+                             normalize_strain_name=normalize_strain_name,
+                             strain_ids_seen=strain_ids_seen)
     with open("genbank_seqs.fasta", "w") as outfasta:
         with open("genbank_seq_metadata.tsv", "w") as outf:
 
-            dw = csv.DictWriter(outf, delimiter='\t', fieldnames=fields_to_write)
+            dw = csv.DictWriter(outf, delimiter='\t', fieldnames=METADATA_FIELDS)
             dw.writeheader()
 
-            for idx, row in enumerate(csv.DictReader(response_content)):
-                # if location is null, continue to the next sequence
-                if len(row["location"]) == 0:
-                    continue
-
-                loc = geocode_location(row["location"], gmaps_client)
-                if loc is not None:
-                    memo[row["location"]] = loc
-                else:
-                    continue
-                
-
-                if row["host"] == "Homo sapiens" and normalize_homo_sapiens_to_human:
-                    host = "Human"
-                else:
-                    host = row["host"].replace(" ", "-")
-
-                #if idx==100:
-                #    exit(0)
-                
-                country = rename_country_to_gisaid_version(loc["country"]) if normalize_country_names_to_gisaid and loc["country"] is not None else loc["country"]
-
-                geolocale_for_strain = country
-                if normalize_country_names_to_gisaid and geolocale_for_strain is not None:
-                    # GISAID uses country names for most places, but uses provinces for China and England/Scotland/Wales/et al. for the UK
-                    # we should map accordingly to handle these exceptions
-                    if geolocale_for_strain == "China":
-                        if len(loc["division"])>1 and loc["division"] != geolocale_for_strain:
-                            geolocale_for_strain = loc["division"]
-                            if len(loc["location"])>1 and loc["location"] != geolocale_for_strain:
-                                geolocale_for_strain = loc["location"]
-                    if geolocale_for_strain.replace(" ","") == "UnitedKingdom":
-                        if len(loc["division"])>1 and loc["division"] != geolocale_for_strain:
-                            geolocale_for_strain = loc["division"]
-
-                try:
-                    collection_date = dateutil.parser.parse(row["collected"], default=placeholder_date_vals).strftime('%Y-%m-%d')  # parse().isoformat()
-                    collection_year = collection_date.split("-")[0] # split ISO8601 date
-                except Exception as e:
-                    print('Skipping due to missing or unparsable date: ', row["genbank_accession"])
-                    continue
-                
-                # try to use GIDAID-style strain information, if provided
-                if row["strain"] is not None and row["strain"] != "":
-                    strain = row["strain"]
-                    strain = remove_strain_prefix(strain,geolocale_for_strain,gisaid_style=normalize_country_names_to_gisaid) if normalize_strain_name else strain
-                    
-                    #strain_parts = re.split(r'[^/]+',strain,maxsplit=3)
-                    m=re.match(r'(.*)/(.*)/(.*)',strain)
-                    if not m or m.group(2) is None:
-                        #print("assembling")
-                        strain = "{country}/{strain}/{collection_year}".format(country=geolocale_for_strain,strain=strain,collection_year=collection_year) # use accession as placeholder for strain ID
-                    #print(strain)
-                else:
-                    strain = "{country}/{genbank_accession}/{collection_year}".format(country=geolocale_for_strain,genbank_accession=row["genbank_accession"],collection_year=collection_year) # use accession as placeholder for strain ID
-
-                strain = strain.replace(" ","")
-
-                # for SARS-CoV-2 only
-                if VIRUS_COL == "ncov":
-                    # if using GISAID-style strain IDs, enforce name format exception used for reference sequence
-                    # that is hard-coded and expected by nextstrain
-                    # see: https://github.com/nextstrain/ncov/blob/master/defaults/include.txt
-                    strain = strain.replace("China/Wuhan-Hu-1/2019", "Wuhan/Hu-1/2019")
-
-                # if we have seen this strain before, continue to the next record
-                # this enforces a uniqeness constraint on strain IDs
-                # which is helpful because duplicates can be present on GenBank
-                # in the case of a GenBank sequence and the RefSeq designated equivalent of the same
-                if strain in strain_ids_seen:
-                    continue
-                else:
-                    # otherwise add the strain to those we have seen before
-                    strain_ids_seen.add(strain)
-
-
-                fields_to_write["strain"] = strain # +"|"+row["genbank_accession"]
-                fields_to_write["virus"] = VIRUS_COL
-                fields_to_write["gisaid_epi_isl"] = None
-                fields_to_write["genbank_accession"] = row["genbank_accession"]
-                fields_to_write["database"] = row["database"]
-                fields_to_write["date"] = collection_date
-                fields_to_write["region"] = loc["continent"]
-                fields_to_write["country"] = country
-                fields_to_write["division"] = loc["division"]
-                fields_to_write["location"] = loc["location"]
-                fields_to_write["gb_raw_location"] = row["location"]
-                fields_to_write["geocode_precision"] = loc["location_precision"][0]
-                fields_to_write["region_exposure"] = loc["continent"]  # should perhaps be set to None
-                fields_to_write["country_exposure"] = loc["country"]  # should perhaps be set to None
-                fields_to_write["division_exposure"] = loc["location"]  # should perhaps be set to None
-                fields_to_write["length"] = len(row["sequence"])
-                fields_to_write["host"] = host
-                fields_to_write["age"] = None
-                fields_to_write["sex"] = None
-                fields_to_write["originating_lab"] = None
-                fields_to_write["submitting_lab"] = None
-                fields_to_write["date_submitted"] = dateutil.parser.parse(row["submitted"], default=placeholder_date_vals).strftime('%Y-%m-%d')  # parse().isoformat()
-                fields_to_write["biosample_accession"] = row["biosample_accession"]
-                fields_to_write["geocat"] = loc["loc_category"]
-                fields_to_write["authors"] = row["authors"]
-                fields_to_write["url"] = None
-                fields_to_write["title"] = row["title"]
-
-                fields_to_write = {key: "NA" if (val is None or val == "") else val for key, val in fields_to_write.items()}
+            record_count = None
+            for record_count, (fields_to_write, sequence) in enumerate(records):
                 dw.writerow(fields_to_write)
 
                 # write sequence to output fasta
-                outfasta.write(">{strain}\n{seq}\n\n".format(strain=strain, seq=row["sequence"]))
-
-                if (idx + 1) % 100 == 0:
-                    print("Found data for %s seqs" % (idx + 1))
+                if sequence is not None:
+                    outfasta.write(">{strain}\n{seq}\n\n".format(strain=fields_to_write["strain"], seq=sequence))
 
-                # to dump reply from GenBank
-                # print(json.dumps(row, allow_nan = False, indent = None, separators = ',:'))
+                if startup_profile and record_count == 0:
+                    outf.flush()
+                    outfasta.flush()
+                    report_time_to_first_record(True)
 
-                # to halt after so many records
-                if RETURN_COUNT_LIMIT is not None:
-                    if idx >= RETURN_COUNT_LIMIT - 1:
-                        break
+            if startup_profile and record_count is None:
+                report_time_to_first_record(False)
 
     with open("genbank_locations_map.tsv", "w") as outf:
         print("Writing genbank_locations_map.tsv file.")
         outf.write("name\tlat\tlon\tprecision\n")
-        for location in sorted(memo):
-            outf.write("\t".join([location] + [str(memo[location]["lat"]), str(memo[location]["lng"])]) + "\n")
+        for location, loc in iter_geocoded_locations(memo):
+            outf.write("\t".join([location] + [str(loc["lat"]), str(loc["lng"])]) + "\n")
+
+
+def write_ndjson_stream(response_content, gmaps_client, out_stream,
+                        flush_every=NDJSON_FLUSH_EVERY,
+                        normalize_homo_sapiens_to_human=True,
+                        normalize_country_names_to_gisaid=True,
+                        normalize_strain_name=True,
+                        startup_profile=False,
+                        geocode_memo=None,
+                        strain_ids_seen=None):
+    """
+     Stream curated records to out_stream as newline-delimited json, as they are curated.
+     Each record is {"type": "record", "metadata": {...}, "sequence": "..."};
+     the location map follows as a single trailing {"type": "locations_map", "locations": [...]} record.
+     out_stream is flushed every flush_every records so downstream consumers can start early.
+    """
+
+    # instantiate dictionary to hold all location info until the trailing record
+    memo = {} if geocode_memo is None else geocode_memo
+    records = curate_records(response_content, gmaps_client, memo,
+                             normalize_homo_sapiens_to_human=normalize_homo_sapiens_to_human,
+                             normalize_country_names_to_gisaid=normalize_country_names_to_gisaid,
+                             normalize_strain_name=normalize_strain_name,
+                             strain_ids_seen=strain_ids_seen)
+    unflushed_count = 0
+    record_count = None
+    for record_count, (fields_to_write, sequence) in enumerate(records):
+        out_stream.write(json.dumps({"type": "record", "metadata": fields_to_write, "sequence": sequence}, separators=(",", ":")) + "\n")
+
+        unflushed_count += 1
+        if unflushed_count >= flush_every:
+            out_stream.flush()
+            unflushed_count = 0
+
+        if startup_profile and record_count == 0:
+            out_stream.flush()
+            report_time_to_first_record(True)
+
+    if startup_profile and record_count is None:
+        report_time_to_first_record(False)
+
+    # write the trailing record one location at a time rather than building the list in memory
+    out_stream.write('{"type":"locations_map","locations":[')
+    for location_count, (location, loc) in enumerate(iter_geocoded_locations(memo)):
+        out_stream.write(("," if location_count else "") + json.dumps({"name": location, "lat": loc["lat"], "lon": loc["lng"]}, separators=(",", ":")))
+    out_stream.write("]}\n")
+    out_stream.flush()
+
+
+def iso_date(date_str):
+    """argparse type for YYYY-MM-DD dates; returns the date normalized to YYYY-MM-DD."""
+
+    try:
+        return datetime.strptime(date_str, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid date %r, expected YYYY-MM-DD" % date_str)
+
+def build_ncbi_filter_queries(collected_from=None, collected_to=None,
+                              submitted_from=None, submitted_to=None,
+                              hosts=None, countries=None, regions=None,
+                              min_length=None, max_length=None,
+                              source_dbs=None):
+    """
+     Translate record filters into solr "fq" clauses for the NCBI Virus vvsearch2 endpoint,
+     so that records are filtered server-side rather than downloaded and discarded.
+     Dates are YYYY-MM-DD and inclusive; lists of values match any of the values given.
+    """
+
+    def solr_date(date_str, next_day=False):
+        # an inclusive "to" date is queried as an exclusive bound at the start of the following day,
+        # so that times within the last second of the day are not dropped
+        date = datetime.strptime(date_str, '%Y-%m-%d') + timedelta(days=1 if next_day else 0)
+        return date.strftime('%Y-%m-%dT00:00:00Z')
+
+    def solr_range(field, low, high, exclusive_high=False):
+        return '{{!tag={field}}}{field}:[{low} TO {high}{close}'.format(field=field,
+                                                                        low="*" if low is None else low,
+                                                                        high="*" if high is None else high,
+                                                                        close="}" if exclusive_high and high is not None else "]")
+
+    def solr_any_of(field, values):
+        quoted = ['"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"')) for value in values]
+        return '{{!tag={field}}}{field}:({values})'.format(field=field, values=" OR ".join(quoted))
+
+    filter_queries = []
+    if collected_from is not None or collected_to is not None:
+        filter_queries.append(solr_range('CollectionDate_dr',
+                                         solr_date(collected_from) if collected_from is not None else None,
+                                         solr_date(collected_to, next_day=True) if collected_to is not None else None,
+                                         exclusive_high=True))
+    if submitted_from is not None or submitted_to is not None:
+        filter_queries.append(solr_range('CreateDate_dt',
+                                         solr_date(submitted_from) if submitted_from is not None else None,
+                                         solr_date(submitted_to, next_day=True) if submitted_to is not None else None,
+                                         exclusive_high=True))
+    if min_length is not None or max_length is not None:
+        filter_queries.append(solr_range('SLen_i', min_length, max_length))
+    if hosts:
+        filter_queries.append(solr_any_of('Host_s', hosts))
+    if countries:
+        filter_queries.append(solr_any_of('Country_s', countries))
+    if regions:
+        filter_queries.append(solr_any_of('Region_s', regions))
+    if source_dbs:
+        filter_queries.append(solr_any_of('SourceDB_s', source_dbs))
+
+    return filter_queries
 
 
 # based on the following by @tsibley: https://github.com/nextstrain/ncov-ingest/blob/master/bin/fetch-from-genbank
             
-def call_ncbi(user_email, virus_taxon_id="2697049"):
-    """Call ncbi to get back response."""
+def call_ncbi(user_email, virus_taxon_id="2697049", filter_queries=None, fields=None):
+    """
+     Call ncbi to get back response.
+     filter_queries are additional solr "fq" clauses (see build_ncbi_filter_queries);
+     fields are the output columns to request, from NCBI_FIELDS (default: all of them).
+    """
+
+    import requests
 
     virus_taxon_id = str(virus_taxon_id)  # NCBI taxon ID
 
+    if fields is None:
+        fields = list(NCBI_FIELDS)
+    missing_fields = [field for field in NCBI_FIELDS_REQUIRED if field not in fields]
+    if missing_fields:
+        raise ValueError("fields required for curation not requested: %s" % ", ".join(missing_fields))
+
     endpoint = "https://www.ncbi.nlm.nih.gov/genomes/VirusVariation/vvsearch2/"
     params = {
         # Search criteria
         'fq': [
             '{!tag=SeqType_s}SeqType_s:("Nucleotide")',  # Nucleotide sequences (as opposed to protein)
             'VirusLineageId_ss:({})'.format(virus_taxon_id),  # NCBI Taxon id for SARS-CoV-2
-        ],
+            'CountryFull_s:[* TO *]',  # location is set; curate_records discards records without one
+        ] + (filter_queries or []),
 
         # Unclear, but seems necessary.
         'q': '*:*',
@@ -661,30 +1079,7 @@ def call_ncbi(user_email, virus_taxon_id="2697049"):
         'cmd': 'download',
         'dlfmt': 'csv',
         'fl': ','.join(
-            ':'.join(names) for names in [
-                # Pairs of (output column name, source data field).  These are pulled
-                # from watching requests from the UI.
-                #
-                # XXX TODO: Is the full set source data fields documented
-                # somewhere?  Is there more info we could be pulling that'd be
-                # useful?
-                #   -trs, 13 May 2020
-                ('genbank_accession', 'id'),
-                ('database', 'SourceDB_s'),
-                ('strain', 'Isolate_s'),
-                ('region', 'Region_s'),
-                ('location', 'CountryFull_s'),
-                ('collected', 'CollectionDate_s'),
-                ('submitted', 'CreateDate_dt'),
-                ('length', 'SLen_i'),
-                ('host', 'Host_s'),
-                ('isolation_source', 'Isolation_csv'),
-                ('biosample_accession', 'BioSample_s'),
-                ('title', 'Definition_s'),
-                ('authors', 'Authors_csv'),
-                ('publications', 'PubMed_csv'),
-                ('sequence', 'Nucleotide_seq'),
-            ]
+            ':'.join((field, NCBI_FIELDS[field])) for field in fields
         ),
 
         # Stable sort with newest last so diffs work nicely.  Columns are source
@@ -712,14 +1107,88 @@ if __name__ == '__main__':
 
     parser.add_argument('-k', '--google_maps_api_key_file', required=True, type=str, help='api key for google maps.')
     parser.add_argument('-e', '--user_email', required=True, type=str, help='name of metadata .tsv file with fasta headers to be extracted from full fasta.')
+    parser.add_argument('--startup_profile', '--startup-profile', action='store_true', help='report the time from process start to the first record written.')
+    parser.add_argument('--ndjson_out', type=str, default=None, help='stream curated records as ndjson to this path (e.g. a named pipe), or "-" for stdout, instead of writing fasta/tsv files.')
+    parser.add_argument('--ndjson_flush_every', type=int, default=NDJSON_FLUSH_EVERY, help='number of records written to the ndjson stream between flushes.')
+    parser.add_argument('--max_memory', type=int, default=None, help='keep strain IDs and geocoded locations within roughly this many MB, spilling the rest to disk, and report peak RSS.')
+    parser.add_argument('--spill_dir', type=str, default=None, help='directory for on-disk state under --max_memory (default: system temp directory).')
+    parser.add_argument('--expected_strains', type=int, default=EXPECTED_STRAIN_COUNT, help='number of strains to size the on-disk strain ID set for under --max_memory.')
+    parser.add_argument('--collected_from', type=iso_date, default=None, help='only request records collected on or after this date (YYYY-MM-DD).')
+    parser.add_argument('--collected_to', type=iso_date, default=None, help='only request records collected on or before this date (YYYY-MM-DD).')
+    parser.add_argument('--submitted_from', type=iso_date, default=None, help='only request records submitted on or after this date (YYYY-MM-DD).')
+    parser.add_argument('--submitted_to', type=iso_date, default=None, help='only request records submitted on or before this date (YYYY-MM-DD).')
+    parser.add_argument('--host', nargs='+', default=None, help='only request records from these hosts (e.g. "Homo sapiens").')
+    parser.add_argument('--country', nargs='+', default=None, help='only request records from these countries, as named by NCBI (e.g. USA).')
+    parser.add_argument('--region', nargs='+', default=None, help='only request records from these regions, as named by NCBI (e.g. "North America").')
+    parser.add_argument('--min_length', type=int, default=None, help='only request sequences at least this long.')
+    parser.add_argument('--max_length', type=int, default=None, help='only request sequences at most this long.')
+    parser.add_argument('--source_db', nargs='+', default=None, help='only request records from these source databases (GenBank, RefSeq).')
+    parser.add_argument('--omit_ncbi_fields', nargs='+', default=[], choices=[field for field in NCBI_FIELDS if field not in NCBI_FIELDS_REQUIRED],
+                        help='columns not to request from NCBI; omit sequence for metadata-only runs.')
 
     args = parser.parse_args()
 
+    # iso_date normalizes to YYYY-MM-DD, so the dates compare correctly as strings
+    for date_from, date_to, option in [(args.collected_from, args.collected_to, "collected"),
+                                       (args.submitted_from, args.submitted_to, "submitted")]:
+        if date_from is not None and date_to is not None and date_from > date_to:
+            parser.error("--{option}_from ({date_from}) is after --{option}_to ({date_to})".format(option=option, date_from=date_from, date_to=date_to))
+    for length, option in [(args.min_length, "min_length"), (args.max_length, "max_length")]:
+        if length is not None and length < 0:
+            parser.error("--{option} ({length}) must not be negative".format(option=option, length=length))
+    if args.min_length is not None and args.max_length is not None and args.min_length > args.max_length:
+        parser.error("--min_length ({}) is greater than --max_length ({})".format(args.min_length, args.max_length))
+    if args.spill_dir is not None and not os.path.isdir(args.spill_dir):
+        parser.error("--spill_dir {} is not an existing directory".format(args.spill_dir))
+
     # create google maps client
     gmaps_client = make_gmaps_client(args.google_maps_api_key_file)
 
-    # call the ncbi endpoint to get back response
-    response_content = call_ncbi(args.user_email)
+    # filters are applied by NCBI, so only matching records are downloaded
+    filter_queries = build_ncbi_filter_queries(collected_from=args.collected_from, collected_to=args.collected_to,
+                                               submitted_from=args.submitted_from, submitted_to=args.submitted_to,
+                                               hosts=args.host, countries=args.country, regions=args.region,
+                                               min_length=args.min_length, max_length=args.max_length,
+                                               source_dbs=args.source_db)
+    fields = [field for field in NCBI_FIELDS if field not in args.omit_ncbi_fields]
 
-    # pass response content to create tsv files
-    write_tsv_files(response_content, gmaps_client)
+    # call the ncbi endpoint to get back response
+    response_content = call_ncbi(args.user_email, filter_queries=filter_queries, fields=fields)
+
+    with contextlib.ExitStack() as exit_stack:
+        if args.max_memory is not None:
+            import tempfile
+            # callbacks run last-in first-out on every exit path (including sys.exit below):
+            # close the stores, then remove the spill directory, then report peak RSS
+            exit_stack.callback(lambda: print("Peak RSS: %.1f MB" % get_peak_rss_mb(), file=sys.stderr))
+            spill_dir = exit_stack.enter_context(tempfile.TemporaryDirectory(dir=args.spill_dir))
+            strain_ids_seen, geocode_memo = make_bounded_memory_stores(args.max_memory, spill_dir,
+                                                                       expected_strain_count=args.expected_strains)
+            exit_stack.callback(strain_ids_seen.close)
+            exit_stack.callback(geocode_memo.close)
+        else:
+            strain_ids_seen, geocode_memo = None, None
+
+        if args.ndjson_out is not None:
+            # when streaming to stdout, keep progress messages out of the stream
+            to_stdout = args.ndjson_out == "-"
+            try:
+                with open(sys.stdout.fileno() if to_stdout else args.ndjson_out, "w", encoding="utf-8",
+                          buffering=NDJSON_BUFFER_BYTES, closefd=not to_stdout) as out_stream:
+                    with contextlib.redirect_stdout(sys.stderr) if to_stdout else contextlib.nullcontext():
+                        write_ndjson_stream(response_content, gmaps_client, out_stream,
+                                            flush_every=args.ndjson_flush_every,
+                                            startup_profile=args.startup_profile,
+                                            geocode_memo=geocode_memo,
+                                            strain_ids_seen=strain_ids_seen)
+            except BrokenPipeError:
+                # the consumer stopped reading (e.g. "| head"); exit quietly, pointing stdout at devnull
+                # so the interpreter's final flush of stdout cannot fail again
+                if to_stdout:
+                    devnull = os.open(os.devnull, os.O_WRONLY)
+                    os.dup2(devnull, sys.stdout.fileno())
+                sys.exit(1)
+        else:
+            # pass response content to create tsv files
+            write_tsv_files(response_content, gmaps_client, startup_profile=args.startup_profile,
+                            geocode_memo=geocode_memo, strain_ids_seen=strain_ids_seen)